@@ -1,173 +1,396 @@
 from openai import OpenAI
 import subprocess
-from typing import List, Dict, Tuple, Set
+from typing import List, Dict, Tuple, Set, Deque, FrozenSet, NamedTuple, Optional
+import selectors
 import shlex
+import shutil
+import socket
 import os
 import re
 from pathlib import Path
 import mysql.connector
 from mysql.connector import Error
-import pandas as pd
+from mysql.connector.errors import InterfaceError, OperationalError, PoolError
+from mysql.connector.pooling import CONNECTION_POOL_LOCK, MySQLConnectionPool, PooledMySQLConnection
+import queue
+import hashlib
 import json
+import sqlite3
 import time
 import threading
 import itertools
 import sys
-import docker
-from docker.errors import NotFound, APIError
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+from types import MappingProxyType
+
+# The translator's COMMAND: line, split into an optional directive and its payload
+COMMAND_PATTERN = re.compile(r"COMMAND:\s*(?:(EXECUTE|LOOP|CONNECT):)?(.*)", re.DOTALL)
+
+# Leading keyword of a command that should be routed to the database
+SQL_KEYWORD_PATTERN = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|SHOW|DESCRIBE|CREATE|USE)\b", re.IGNORECASE)
+
+# A whole pip requirement: name[extras] plus optional version specifiers. Anything
+# else (URLs, paths, name @ url, environment markers) must not reach pip install
+PACKAGE_REQUIREMENT_PATTERN = re.compile(
+    r"(?P<name>[A-Za-z0-9][A-Za-z0-9_.\-]*)"
+    r"(?:\[[A-Za-z0-9_.\-,]*\])?"
+    r"(?:(?:===|==|!=|<=|>=|~=|<|>)[A-Za-z0-9_.*+!\-]+"
+    r"(?:,(?:===|==|!=|<=|>=|~=|<|>)[A-Za-z0-9_.*+!\-]+)*)?"
+)
+
+# Characters that turn a pip argument into a URL or a local path
+PACKAGE_PATH_CHARS = frozenset('/@:\\')
+
+# Search path for commands run on behalf of the user
+SUBPROCESS_PATH = "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"
+SUBPROCESS_ENV = MappingProxyType({"PATH": SUBPROCESS_PATH})
+
+# Docker creates this file in every container; outside one there is no network to wire up
+IN_DOCKER = os.path.exists('/.dockerenv')
+
+# Container id in cgroup v1 paths (/docker/<id>) and systemd v2 scopes (docker-<id>.scope)
+CONTAINER_ID_PATTERN = re.compile(r"docker[-/]([0-9a-f]{12,64})")
+
+@lru_cache(maxsize=256)
+def split_command(command_str: str) -> Tuple[str, ...]:
+    """shlex.split a command, memoized since translations often repeat."""
+    return tuple(shlex.split(command_str))
+
+@lru_cache(maxsize=None)
+def current_container_id() -> str:
+    """Id of the container this process runs in, read once per process."""
+    match = CONTAINER_ID_PATTERN.search(Path('/proc/self/cgroup').read_text())
+    if match:
+        return match.group(1)
+    # Under cgroup v2 with a private namespace the cgroup file is just "0::/";
+    # Docker sets the hostname to the short container id instead
+    return socket.gethostname()
+
+def quote_identifier(name: str) -> str:
+    """Backtick-quote a MySQL identifier such as a table name."""
+    return "`" + name.replace("`", "``") + "`"
+
+class CommandRule(NamedTuple):
+    """Permitted flags and argument count for an allowed command."""
+    allowed_flags: FrozenSet[str]
+    max_args: int
+    description: str
+    exe: Optional[str]  # Absolute path resolved against SUBPROCESS_PATH
+
+def _rule(command: str, allowed_flags: FrozenSet[str], max_args: int, description: str) -> CommandRule:
+    """Build a CommandRule, resolving the executable once at import time."""
+    return CommandRule(allowed_flags, max_args, description, shutil.which(command, path=SUBPROCESS_PATH))
+
+# Define allowed commands with their permitted arguments/flags (built once per process)
+COMMAND_RULES = MappingProxyType({
+    'cd': _rule('cd', frozenset(), 1, 'Change directory'),  # cd doesn't typically use flags
+    'pwd': _rule('pwd', frozenset(), 0, 'Print working directory'),  # pwd doesn't typically use flags
+    'ls': _rule('ls', frozenset({'-l', '-a', '-h', '-r', '--sort', '-S', '-lh', '-lS', '-la', '-lha'}), 2, 'List directory contents'),
+    'grep': _rule('grep', frozenset({'-i', '-v', '-n', '-r', '-l', '--recursive'}), 4, 'Search for patterns'),
+    'find': _rule('find', frozenset({'-type', '-name', '-f'}), 4, 'Search for files'),
+    'cat': _rule('cat', frozenset({'-n', '--number'}), 2, 'Display file contents'),
+    'head': _rule('head', frozenset({'-n'}), 2, 'Output the first part of files'),
+    'tail': _rule('tail', frozenset({'-n', '-f'}), 2, 'Output the last part of files'),
+    'wc': _rule('wc', frozenset({'-l', '-w', '-c'}), 2, 'Print newline, word, and byte counts'),
+    'sort': _rule('sort', frozenset({'-r', '-n'}), 2, 'Sort lines of text files'),
+    'uniq': _rule('uniq', frozenset({'-c', '-d', '-u'}), 2, 'Report or omit repeated lines'),
+    'echo': _rule('echo', frozenset({'-n', '-e'}), 10, 'Display a line of text'),
+    'ps': _rule('ps', frozenset({'-e', '-f', '-a'}), 1, 'Report process status'),
+    'df': _rule('df', frozenset({'-h', '-i'}), 1, 'Report file system disk space usage'),
+    'du': _rule('du', frozenset({'-h', '-s', '-a', '-sh'}), 2, 'Estimate file space usage'),
+    'python': _rule('python', frozenset({'-u', '-m', '-c'}), 2, 'Execute Python scripts'),
+    'python3': _rule('python3', frozenset({'-u', '-m', '-c'}), 2, 'Execute Python scripts'),
+    'pip': _rule('pip', frozenset({'install', 'uninstall', 'list', 'freeze', '--version', '-r', '--user'}), 4, 'Python package manager'),
+    'pip3': _rule('pip3', frozenset({'install', 'uninstall', 'list', 'freeze', '--version', '-r', '--user'}), 4, 'Python package manager'),
+    'mysql': _rule('mysql', frozenset({'-e', '--execute', '-D', '--database', 'USE'}), 5, 'Execute MySQL commands'),
+    'query': _rule('query', frozenset(), 1, 'Execute SQL queries'),  # Custom command for SQL queries
+})
+
+# Define allowed pip packages for security
+ALLOWED_PACKAGES = frozenset({
+    'requests',
+    'pandas',
+    'numpy',
+    'matplotlib',
+    'scikit-learn',
+    'tensorflow',
+    'torch',
+    'flask',
+    'django',
+    'pytest',
+    'beautifulsoup4',
+    'pillow',
+    'opencv-python',
+    'sqlalchemy',
+    'psycopg2-binary',
+    'pymongo',
+    'redis',
+    'celery',
+    'fastapi',
+    'uvicorn',
+    'aiohttp',
+    'jupyter',
+})
+
+# pip subcommands that only read the environment
+PIP_READONLY_COMMANDS = frozenset({'list', 'freeze', '--version'})
+
+class OptimisticConnectionPool(MySQLConnectionPool):
+    """MySQL pool that hands out connections without pinging them first.
+
+    The stock pool sends a ping on every borrow, an extra round trip per query.
+    Callers reopen a connection themselves when a query finds it dead.
+    The override reads private pool attributes that are stable across the
+    connector range pinned in docker/requirements.txt; on any other layout it
+    falls back to the stock get_connection().
+    """
+
+    POOL_INTERNALS = ('_cnx_queue', '_config_version', '_cnx_config', '_queue_connection')
+
+    def get_connection(self) -> PooledMySQLConnection:
+        if not all(hasattr(self, name) for name in self.POOL_INTERNALS):
+            return super().get_connection()
+        with CONNECTION_POOL_LOCK:
+            try:
+                cnx = self._cnx_queue.get(block=False)
+            except queue.Empty as err:
+                raise PoolError("Failed getting connection; pool exhausted") from err
+
+            # Only a changed pool configuration forces a reconnect here
+            if self._config_version != cnx.pool_config_version:
+                cnx.config(**self._cnx_config)
+                try:
+                    cnx.reconnect()
+                except InterfaceError:
+                    self._queue_connection(cnx)
+                    raise
+                cnx.pool_config_version = self._config_version
+
+            return PooledMySQLConnection(self, cnx)
+
+class TranslationStore:
+    """SQLite-backed cache key -> translation store that survives restarts."""
+    PATH = Path.home() / '.cache' / 'easylinux' / 'prompts.sqlite'
+    TTL_SECONDS = 7 * 24 * 60 * 60
+    MAX_ROWS = 1000
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls) -> Optional['TranslationStore']:
+        """Return the process-wide store, or None if it cannot be opened."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                try:
+                    cls._shared = cls(cls.PATH)
+                except (OSError, sqlite3.Error) as e:
+                    print(f"Translation store disabled: {e}")
+                    cls._shared = False
+            return cls._shared or None
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(path), check_same_thread=False)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT, ts REAL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a fresh translation for key and mark it as recently used."""
+        now = time.time()
+        try:
+            with self.lock, self.db:
+                row = self.db.execute(
+                    "SELECT translation FROM translations WHERE key = ? AND ts > ?",
+                    (key, now - self.TTL_SECONDS)
+                ).fetchone()
+                if row is not None:
+                    self.db.execute("UPDATE translations SET ts = ? WHERE key = ?", (now, key))
+            return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"Translation store error: {e}")
+            return None
+
+    def set(self, key: str, translation: str):
+        """Store a translation, evicting the least recently used rows beyond MAX_ROWS."""
+        try:
+            with self.lock, self.db:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO translations (key, translation, ts) VALUES (?, ?, ?)",
+                    (key, translation, time.time())
+                )
+                self.db.execute(
+                    "DELETE FROM translations WHERE key NOT IN "
+                    "(SELECT key FROM translations ORDER BY ts DESC LIMIT ?)",
+                    (self.MAX_ROWS,)
+                )
+        except sqlite3.Error as e:
+            print(f"Translation store error: {e}")
+
+    def discard(self, key: str):
+        """Remove a translation that no longer runs."""
+        try:
+            with self.lock, self.db:
+                self.db.execute("DELETE FROM translations WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            print(f"Translation store error: {e}")
 
 class AIAgent:
+    # Maximum number of remembered user_input -> translation pairs
+    TRANSLATION_CACHE_SIZE = 256
+
+    # History messages preceding a request that are part of its cache key
+    TRANSLATION_CACHE_CONTEXT = 2
+
+    # Oldest messages are dropped from the conversation history beyond this size
+    HISTORY_LIMIT = 20
+
+    # Minimum number of recent history messages sent along with the translation prompt
+    TRANSLATION_WINDOW = 4
+
+    # Connections opened per database pool; each query borrows one for its duration
+    DB_POOL_SIZE = 5
+
+    # Commands run at once by LOOP FILE
+    LOOP_WORKERS = 8
+
+    # Background installs tracked per agent; finished ones are dropped first
+    MAX_INSTALL_JOBS = 32
+
+    # LOOP FILE commands that print one "<numbers> <path>" line per file, so a
+    # single invocation can cover every file and its output split back apart
+    LOOP_BATCH_COMMANDS = frozenset({'wc', 'du'})
+
+    # Bytes kept per output stream; the command is stopped once either passes this
+    OUTPUT_LIMIT = 1 << 20
+
+    # Largest result table rendered back to the user; bigger ones are elided in the middle
+    DISPLAY_MAX_ROWS = 100
+    DISPLAY_MAX_COLS = 25
+
+    SAFETY_PROMPT = """You are a security validator for shell commands. Your job is to determine if a natural language command could be harmful.
+    
+    Safe commands include:
+    - File reading/listing (ls, cat, head, tail, less, pwd)
+    - File searching/counting (find, grep, wc)
+    - System information (pwd, ps, df, du)
+    - Basic text processing (sort, uniq, echo)
+    - Development tools (python, pip with allowed packages)
+    
+    Consider a command UNSAFE only if it could:
+    1. Modify or delete files/directories (rm, mv, chmod, chown)
+    2. Access sensitive system files (/etc/passwd, /etc/shadow)
+    3. Change system settings or configuration
+    4. Execute arbitrary downloaded code
+    5. Access network services or open ports
+    6. Attempt privilege escalation
+    
+    Output ONLY 'SAFE' or 'UNSAFE: <specific reason>'.
+    When in doubt about a command's safety, consider it SAFE and let the command validator handle specific restrictions.
+    """
+
+    TRANSLATION_PROMPT = """You are an expert Linux command translator. Convert natural language into executable shell commands.
+    
+    Current working directory: /app/test
+    Available commands: ls, cd, grep, find, cat, head, tail, wc, sort, uniq, echo, ps, df, du, pwd, python, pip, pip_status
+    
+    Rules:
+    1. For database operations, use format: EXECUTE: <sql_query>
+    2. For operations on files, choose between:
+       a) Single command (if possible): EXECUTE: <command>
+       b) Loop over files: LOOP: FILE:<command>
+    3. For database connections, use format: CONNECT: {connection_json}
+    
+    Examples:
+    - "show size of each file" → LOOP: FILE:du -h
+    - "show content of all files" → LOOP: FILE:cat
+    - "count lines in each file" → LOOP: FILE:wc -l
+    - "list files" → EXECUTE: ls
+    - "show current directory" → EXECUTE: pwd
+    - "find all python files" → EXECUTE: find . -name "*.py"
+    - "show first 5 lines of each file" → LOOP: FILE:head -n 5
+    - "is install job 3 finished" → EXECUTE: pip_status 3
+    
+    Plan your translation:
+    1. Identify if the operation needs to be applied to each file or can be done with a single command
+    2. Choose the most appropriate command
+    3. Add necessary flags and arguments
+    4. Validate paths are within working directory
+    
+    Output format:
+    PLAN: Brief explanation of what you'll do
+    COMMAND: The actual command to execute, on a single line
+    """
+
+    # Read-only commands that are always safe to run without path arguments
+    FAST_SAFE_COMMANDS = frozenset({'ls', 'pwd', 'cat', 'head', 'tail', 'echo', 'wc', 'df', 'du', 'ps'})
+
+    # Markers recording that a working directory's test files exist; kept next to the
+    # translation store so they never show up in the user's listings or LOOP FILE scans
+    TEST_ENV_SENTINEL_DIR = TranslationStore.PATH.parent / 'test-env'
+
+    # Files created in the working directory the first time an agent starts
+    TEST_FILES = {
+        'test.txt': 'This is a test file\nIt has multiple lines\nSome lines have errors\nERROR: test error\nLet\'s break this down',
+        'test.py': 'print("Hello from Python")\n# Test comment\nvar = "test"\nif True:\n    break',
+        'logs/app.log': 'ERROR: Another error\nInfo: normal log\nDebug: break point hit',
+        'data.txt': 'Test data 1\nTest data 2\nTest data 1\nBreak time'
+    }
+    TEST_FILE_NAMES = tuple(TEST_FILES)
+    TEST_FILE_DATA = tuple(content.encode() for content in TEST_FILES.values())
+    TEST_FILE_DIRS = tuple(sorted({os.path.dirname(name) for name in TEST_FILES}))
+
+    # System messages are built once and shared by every request
+    SAFETY_MESSAGE = {"role": "system", "content": SAFETY_PROMPT}
+    TRANSLATION_MESSAGE = {"role": "system", "content": TRANSLATION_PROMPT}
+    
+    # Model settings for the two completion calls; only the messages vary per call.
+    # The safety verdict is a single line, so generation stops at the first newline.
+    SAFETY_REQUEST = {"model": "gpt-4", "temperature": 0.1, "max_tokens": 50, "stop": ["\n"]}
+    TRANSLATION_REQUEST = {"model": "gpt-4", "temperature": 0.7, "max_tokens": 150, "stream": True}
+    # Cached translations only apply to the model and prompt that produced them
+    TRANSLATION_CACHE_VERSION = hashlib.sha256(
+        json.dumps([TRANSLATION_REQUEST["model"], TRANSLATION_PROMPT]).encode()
+    ).hexdigest()
+    
+    # CONNECT details that must be present before any driver is called
+    REQUIRED_CONNECTION_PARAMS = ('type', 'host', 'user', 'password')
+    
+    # Set process-wide once ensure_docker_network has wired up the containers
+    docker_network_message: Optional[str] = None
+
     def __init__(self, api_key: str):
-        # First try to install docker package if not present
-        try:
-            import docker
-        except ImportError:
-            print("\rInstalling docker package...")
-            import subprocess
-            subprocess.check_call(["pip", "install", "docker"])
-            import docker
-        
+        # Each agent owns its client and the HTTP connection pool behind it; see close()
         self.client = OpenAI(api_key=api_key)
-        self.conversation_history: List[Dict] = []
+        self.conversation_history: Deque[Dict] = deque(maxlen=self.HISTORY_LIMIT)
+        self.translation_cache: OrderedDict[str, str] = OrderedDict()
+        self.translation_store = TranslationStore.shared()
+        # The store is shared on disk, so entries are scoped to the key that produced them
+        self.cache_scope = hashlib.sha256(api_key.encode()).hexdigest()
+        # System prompt followed by the last TRANSLATION_WINDOW to 2 * TRANSLATION_WINDOW history messages
+        self.translation_messages: List[Dict] = [self.TRANSLATION_MESSAGE]
+        # Set by run_process when a command of the current request hit OUTPUT_LIMIT
+        self.output_truncated = False
+        # Database each pooled MySQL session is on, by connection id, once switched by a USE
+        self.session_databases: Dict[int, str] = {}
         self.working_directory = "/app/test"  # Changed to test directory
+        self.working_directory_abs = os.path.abspath(self.working_directory)
+        self.working_directory_prefix = os.path.join(self.working_directory_abs, '')
         
         # Create test files if they don't exist
         self.initialize_test_environment()
         
         # Define allowed commands with their permitted arguments/flags
-        self.command_rules = {
-            'cd': {
-                'allowed_flags': set(),  # cd doesn't typically use flags
-                'max_args': 1,
-                'description': 'Change directory'
-            },
-            'pwd': {
-                'allowed_flags': set(),  # pwd doesn't typically use flags
-                'max_args': 0,
-                'description': 'Print working directory'
-            },
-            'ls': {
-                'allowed_flags': {'-l', '-a', '-h', '-r', '--sort', '-S', '-lh', '-lS', '-la', '-lha'},
-                'max_args': 2,
-                'description': 'List directory contents'
-            },
-            'grep': {
-                'allowed_flags': {'-i', '-v', '-n', '-r', '-l', '--recursive'},
-                'max_args': 4,
-                'description': 'Search for patterns'
-            },
-            'find': {
-                'allowed_flags': {'-type', '-name', '-f'},
-                'max_args': 4,
-                'description': 'Search for files'
-            },
-            'cat': {
-                'allowed_flags': {'-n', '--number'},
-                'max_args': 2,
-                'description': 'Display file contents'
-            },
-            'head': {
-                'allowed_flags': {'-n'},
-                'max_args': 2,
-                'description': 'Output the first part of files'
-            },
-            'tail': {
-                'allowed_flags': {'-n', '-f'},
-                'max_args': 2,
-                'description': 'Output the last part of files'
-            },
-            'wc': {
-                'allowed_flags': {'-l', '-w', '-c'},
-                'max_args': 2,
-                'description': 'Print newline, word, and byte counts'
-            },
-            'sort': {
-                'allowed_flags': {'-r', '-n'},
-                'max_args': 2,
-                'description': 'Sort lines of text files'
-            },
-            'uniq': {
-                'allowed_flags': {'-c', '-d', '-u'},
-                'max_args': 2,
-                'description': 'Report or omit repeated lines'
-            },
-            'echo': {
-                'allowed_flags': {'-n', '-e'},
-                'max_args': 10,
-                'description': 'Display a line of text'
-            },
-            'ps': {
-                'allowed_flags': {'-e', '-f', '-a'},
-                'max_args': 1,
-                'description': 'Report process status'
-            },
-            'df': {
-                'allowed_flags': {'-h', '-i'},
-                'max_args': 1,
-                'description': 'Report file system disk space usage'
-            },
-            'du': {
-                'allowed_flags': {'-h', '-s', '-a', '-sh'},
-                'max_args': 2,
-                'description': 'Estimate file space usage'
-            },
-            'python': {
-                'allowed_flags': {'-u', '-m', '-c'},
-                'max_args': 2,
-                'description': 'Execute Python scripts'
-            },
-            'python3': {
-                'allowed_flags': {'-u', '-m', '-c'},
-                'max_args': 2,
-                'description': 'Execute Python scripts'
-            },
-            'pip': {
-                'allowed_flags': {'install', 'uninstall', 'list', 'freeze', '--version', '-r', '--user'},
-                'max_args': 4,
-                'description': 'Python package manager'
-            },
-            'pip3': {
-                'allowed_flags': {'install', 'uninstall', 'list', 'freeze', '--version', '-r', '--user'},
-                'max_args': 4,
-                'description': 'Python package manager'
-            },
-            'mysql': {
-                'allowed_flags': {'-e', '--execute', '-D', '--database', 'USE'},
-                'max_args': 5,
-                'description': 'Execute MySQL commands'
-            },
-            'query': {
-                'allowed_flags': set(),  # Custom command for SQL queries
-                'max_args': 1,
-                'description': 'Execute SQL queries'
-            }
-        }
+        self.command_rules = COMMAND_RULES
         
         # Define allowed pip packages for security
-        self.allowed_packages = {
-            'requests',
-            'pandas',
-            'numpy',
-            'matplotlib',
-            'scikit-learn',
-            'tensorflow',
-            'torch',
-            'flask',
-            'django',
-            'pytest',
-            'beautifulsoup4',
-            'pillow',
-            'opencv-python',
-            'sqlalchemy',
-            'psycopg2-binary',
-            'pymongo',
-            'redis',
-            'celery',
-            'fastapi',
-            'uvicorn',
-            'aiohttp',
-            'jupyter'
-        }
+        self.allowed_packages = ALLOWED_PACKAGES
         
         # Add MySQL connection
         self.db_config = {
@@ -176,83 +399,139 @@ class AIAgent:
             'password': os.getenv('MYSQL_PASSWORD', 'rootpassword'),
             'database': os.getenv('MYSQL_DATABASE', 'testdb')
         }
-        self.db_connection = None
+        self.db_pool: Optional[MySQLConnectionPool] = None
+        self.current_database: Optional[str] = None
+        
+        # Per-command validators for commands with special cases
+        self.command_validators = {
+            'python': self._validate_python,
+            'python3': self._validate_python,
+            'pip': self._validate_pip,
+            'pip3': self._validate_pip,
+        }
+        
+        # Package installs run one at a time off the request path; jobs are polled with pip_status
+        self.install_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pip-install')
+        self.install_jobs: Dict[int, Tuple[str, Future]] = {}
+        self.install_job_ids = itertools.count(1)
+        
+        # The safety check runs here while the translation streams on the request thread
+        self.safety_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='safety-check')
+        
+        # Commands that need more than validate-and-run; see execute_command
+        self.command_runners = {
+            'cd': self._run_cd,
+            'pip_status': self._run_pip_status,
+            'python': self._run_python,
+            'python3': self._run_python,
+            'pip': self._run_pip,
+            'pip3': self._run_pip,
+            'echo': self._run_echo,
+        }
+        
+        # Per-keyword SQL handlers; anything else is run and committed by _handle_write
+        self.query_handlers = {
+            'USE': self._handle_use,
+            'SHOW': self._handle_show,
+            'DESCRIBE': self._handle_describe,
+            'SELECT': self._handle_select,
+        }
+        
+        # Validation only depends on the command and its arguments, so memoize it per agent
+        self._validate_command_cached = lru_cache(maxsize=512)(self._validate_command)
 
     def initialize_test_environment(self):
         """Create test files and directories if they don't exist."""
         try:
-            os.makedirs(self.working_directory, exist_ok=True)
-            test_files = {
-                'test.txt': 'This is a test file\nIt has multiple lines\nSome lines have errors\nERROR: test error\nLet\'s break this down',
-                'test.py': 'print("Hello from Python")\n# Test comment\nvar = "test"\nif True:\n    break',
-                'logs/app.log': 'ERROR: Another error\nInfo: normal log\nDebug: break point hit',
-                'data.txt': 'Test data 1\nTest data 2\nTest data 1\nBreak time'
-            }
+            sentinel = self.TEST_ENV_SENTINEL_DIR / hashlib.sha256(self.working_directory_abs.encode()).hexdigest()[:16]
+            if sentinel.exists() and os.path.isdir(self.working_directory):
+                return
             
-            for filename, content in test_files.items():
-                filepath = os.path.join(self.working_directory, filename)
-                os.makedirs(os.path.dirname(filepath), exist_ok=True)
-                with open(filepath, 'w') as f:
-                    f.write(content)
+            for directory in self.TEST_FILE_DIRS:
+                os.makedirs(os.path.join(self.working_directory, directory), exist_ok=True)
+            for filename, data in zip(self.TEST_FILE_NAMES, self.TEST_FILE_DATA):
+                # Contents are pre-encoded, so write the bytes straight to the fd
+                fd = os.open(os.path.join(self.working_directory, filename), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    os.write(fd, data)
+                finally:
+                    os.close(fd)
+            # Earlier versions left their marker inside the working directory
+            Path(self.working_directory, '.initialized').unlink(missing_ok=True)
+            sentinel.parent.mkdir(parents=True, exist_ok=True)
+            sentinel.touch()
         except Exception as e:
             print(f"Error initializing test environment: {e}")
 
     def add_to_history(self, role: str, content: str):
         """Add a message to the conversation history."""
-        self.conversation_history.append({"role": role, "content": content})
+        message = {"role": role, "content": content}
+        self.conversation_history.append(message)
+        
+        # Keep the ready-to-send translation messages in step with the history.
+        # They are append-only between trims so consecutive requests share a
+        # prompt prefix the provider can cache; trimming drops a whole window at once.
+        self.translation_messages.append(message)
+        if len(self.translation_messages) > 2 * self.TRANSLATION_WINDOW + 1:
+            del self.translation_messages[1:-self.TRANSLATION_WINDOW]
 
     def validate_path(self, path: str) -> bool:
         """Validate if a path is safe to access."""
-        try:
-            # Convert to absolute path
-            abs_path = os.path.abspath(os.path.join(self.working_directory, path))
-            # Check if path is within allowed directory
-            return abs_path.startswith(self.working_directory)
-        except:
-            return False
+        # Normalize against the cached absolute working directory (no getcwd call)
+        abs_path = os.path.normpath(os.path.join(self.working_directory_abs, path))
+        return self.is_within_working_directory(abs_path)
+
+    def is_within_working_directory(self, abs_path: str) -> bool:
+        """Check, component-wise, that a normalized absolute path stays inside the working directory."""
+        # A plain startswith would also accept siblings such as /app/test2
+        return abs_path == self.working_directory_abs or abs_path.startswith(self.working_directory_prefix)
 
     def validate_command(self, command: str, args: List[str]) -> Tuple[bool, str]:
         """Validate command and its arguments."""
-        if command not in self.command_rules:
+        return self._validate_command_cached(command, tuple(args))
+
+    def _validate_command(self, command: str, args: Tuple[str, ...]) -> Tuple[bool, str]:
+        """Uncached validation behind validate_command."""
+        rules = self.command_rules.get(command)
+        if rules is None:
             return False, f"Command '{command}' is not allowed"
-            
-        rules = self.command_rules[command]
         
-        # Special handling for python -c commands
-        if command in {'python', 'python3'} and len(args) >= 2 and args[0] == '-c':
-            return True, ""  # Allow python -c commands
-        
-        # Special handling for pip/pip3 install commands
-        if command in {'pip', 'pip3'} and args and args[0] == 'install':
+        # Commands with special cases get their own validator
+        validator = self.command_validators.get(command, self._validate_arguments)
+        return validator(rules, args)
+
+    def _validate_python(self, rules: CommandRule, args: Tuple[str, ...]) -> Tuple[bool, str]:
+        """Allow python -c commands, otherwise validate like any other command."""
+        if len(args) >= 2 and args[0] == '-c':
+            return True, ""
+        return self._validate_arguments(rules, args)
+
+    def _validate_pip(self, rules: CommandRule, args: Tuple[str, ...]) -> Tuple[bool, str]:
+        """Check pip install against the package allow-list."""
+        if args and args[0] == 'install':
             return self.validate_pip_command(args)
-        
-        # Special handling for ls with combined flags
-        if command == 'ls':
-            # Allow common combined flags for ls
-            combined_flags = {'-lS', '-lh', '-la', '-lha'}
-            processed_args = []
-            for arg in args:
-                if arg in combined_flags or arg in rules['allowed_flags']:
-                    processed_args.append(arg)
-                else:
-                    processed_args.append(arg)
-            args = processed_args
-        
-        flags = {arg for arg in args if arg.startswith('-')}
-        non_flags = [arg for arg in args if not arg.startswith('-')]
-        
-        # Validate flags
-        invalid_flags = flags - rules['allowed_flags']
-        if invalid_flags:
-            return False, f"Invalid flags: {invalid_flags}"
+        return self._validate_arguments(rules, args)
+
+    def _validate_arguments(self, rules: CommandRule, args: Tuple[str, ...]) -> Tuple[bool, str]:
+        """Validate flags, argument count and paths against a command's rules."""
+        # Validate flags and collect the remaining arguments in a single pass
+        allowed_flags = rules.allowed_flags
+        non_flags = []
+        for arg in args:
+            if arg[:1] == '-':
+                if arg not in allowed_flags:
+                    return False, f"Invalid flag: {arg}"
+            else:
+                non_flags.append(arg)
             
         # Validate number of arguments
-        if len(non_flags) > rules['max_args']:
-            return False, f"Too many arguments. Maximum allowed: {rules['max_args']}"
+        if len(non_flags) > rules.max_args:
+            return False, f"Too many arguments. Maximum allowed: {rules.max_args}"
             
-        # Validate paths in arguments
+        # Validate paths in arguments; a bare name without '/' or a leading '.'
+        # always resolves inside the working directory, so only check the rest
         for arg in non_flags:
-            if not self.validate_path(arg):
+            if ('/' in arg or arg[:1] == '.') and not self.validate_path(arg):
                 return False, f"Invalid path: {arg}"
                 
         return True, ""
@@ -265,33 +544,51 @@ class AIAgent:
         command = args[0]
         if command == 'install':
             # Check if package is in allowed list
-            packages = [arg for arg in args[1:] if not arg.startswith('-')]
+            packages = [arg for arg in args[1:] if arg[:1] != '-']
             for package in packages:
-                # Remove version specifiers for checking
-                base_package = package.split('==')[0].split('>=')[0].split('<=')[0]
+                # The whole argument must be a plain requirement; only its name is checked
+                match = PACKAGE_REQUIREMENT_PATTERN.fullmatch(package)
+                if match is None or not PACKAGE_PATH_CHARS.isdisjoint(package):
+                    return False, f"Package '{package}' is not a plain package requirement"
+                base_package = match.group('name')
                 if base_package not in self.allowed_packages:
                     return False, f"Package '{base_package}' is not in the allowed list"
-        elif command not in {'list', 'freeze', '--version'}:
+        elif command not in PIP_READONLY_COMMANDS:
             return False, f"Pip command '{command}' is not allowed"
             
         return True, ""
 
     def connect_to_db(self) -> bool:
-        """Establish database connection."""
+        """Check that a connection pool is available."""
+        # If we explicitly disconnected, don't auto-reconnect; stale pooled
+        # connections are reopened by db_cursor when a query trips over them
+        return self.db_pool is not None
+
+    @contextmanager
+    def db_cursor(self, **cursor_options):
+        """Borrow a pooled connection for one unit of work and yield it with a cursor."""
+        connection = self.db_pool.get_connection()
         try:
-            # If we explicitly disconnected, don't auto-reconnect
-            if self.db_connection is None:
-                return False
-            
-            # If connection exists but is stale, reconnect
-            if not self.db_connection.is_connected():
-                self.db_connection.ping(reconnect=True)
-            
-            return True
-        except Error as e:
-            print(f"Error connecting to MySQL: {e}")
-            self.db_connection = None
-            return False
+            # Pooled sessions may still be on another database; only those get the USE <db> switch
+            if self.current_database and self.session_databases.get(connection.connection_id) != self.current_database:
+                connection.cmd_init_db(self.current_database)
+                self.session_databases[connection.connection_id] = self.current_database
+            cursor = connection.cursor(**cursor_options)
+            try:
+                yield connection, cursor
+            finally:
+                cursor.close()
+        except (OperationalError, InterfaceError):
+            # Borrowed connections are not pinged, so this one may have gone stale;
+            # reopen it before it goes back to the pool
+            self.session_databases.pop(connection.connection_id, None)
+            try:
+                connection.reconnect()
+            except Error:
+                pass
+            raise
+        finally:
+            connection.close()  # Returns the connection to the pool
 
     def execute_query(self, query: str) -> Tuple[str, bool]:
         """Execute SQL query and return results."""
@@ -299,52 +596,86 @@ class AIAgent:
             if not self.connect_to_db():
                 return "Database Status: Not connected\nAction Required: Please connect to a database first", False
 
-            cursor = self.db_connection.cursor(dictionary=True)
-            
-            # Handle USE database command
-            if query.strip().upper().startswith('USE'):
-                try:
-                    cursor.execute(query)
-                    self.db_connection.database = query.split()[1].strip(';')  # Update current database
-                    return f"Successfully switched to database: {self.db_connection.database}", True
-                except Error as e:
-                    return f"Failed to switch database: {str(e)}", False
-            
-            cursor.execute(query)
-            
-            # Handle SHOW TABLES and DESCRIBE commands
-            if query.strip().upper().startswith(('SHOW', 'DESCRIBE')):
-                results = cursor.fetchall()
-                if not results:
-                    return "Query executed successfully\nResult: No tables found in database", True
-                
-                # Format results for SHOW TABLES
-                if query.strip().upper().startswith('SHOW'):
-                    tables = [list(row.values())[0] for row in results]
-                    return f"Query executed successfully\nFound {len(tables)} table(s):\n- " + "\n- ".join(tables), True
-                
-                # Format results for DESCRIBE
-                df = pd.DataFrame(results)
-                return f"Query executed successfully\nTable Structure:\n{df.to_string()}", True
-                
-            elif query.strip().upper().startswith('SELECT'):
-                results = cursor.fetchall()
-                if not results:
-                    return "Query executed successfully\nResult: No rows returned", True
-                
-                df = pd.DataFrame(results)
-                row_count = len(results)
-                col_count = len(df.columns)
-                return f"Query executed successfully\nReturned: {row_count} row(s), {col_count} column(s)\n{df.to_string()}", True
-            else:
-                self.db_connection.commit()
-                return f"Query executed successfully\nAffected rows: {cursor.rowcount}", True
+            # Only the leading keyword is upper-cased, not the whole query
+            match = SQL_KEYWORD_PATTERN.match(query)
+            keyword = match.group(1).upper() if match else ''
+
+            # Write statements (INSERT, UPDATE, CREATE, ...) share the commit handler
+            handler = self.query_handlers.get(keyword, self._handle_write)
+            try:
+                with self.db_cursor() as (connection, cursor):
+                    return handler(connection, cursor, query)
+            except (OperationalError, InterfaceError):
+                # Retry once on a fresh connection, but never re-run a write
+                # the server may already have applied
+                if keyword not in self.query_handlers:
+                    raise
+                with self.db_cursor() as (connection, cursor):
+                    return handler(connection, cursor, query)
                 
         except Error as e:
             return f"Database Error: {str(e)}\nQuery: {query}", False
-        finally:
-            if 'cursor' in locals():
-                cursor.close()
+
+    def _handle_use(self, connection, cursor, query: str) -> Tuple[str, bool]:
+        """Switch the database used by later queries."""
+        try:
+            cursor.execute(query)
+            self.current_database = query.split()[1].strip(';')  # Update current database
+            self.session_databases[connection.connection_id] = self.current_database
+            return f"Successfully switched to database: {self.current_database}", True
+        except (OperationalError, InterfaceError):
+            raise  # Lost connection; let execute_query retry it
+        except Error as e:
+            return f"Failed to switch database: {str(e)}", False
+
+    def _handle_show(self, connection, cursor, query: str) -> Tuple[str, bool]:
+        """List the names returned by SHOW TABLES and friends."""
+        cursor.execute(query)
+        results = cursor.fetchall()
+        if not results:
+            return "Query executed successfully\nResult: No tables found in database", True
+        tables = [row[0] for row in results]
+        return f"Query executed successfully\nFound {len(tables)} table(s):\n- " + "\n- ".join(tables), True
+
+    def _handle_describe(self, connection, cursor, query: str) -> Tuple[str, bool]:
+        """Render a table's structure."""
+        cursor.execute(query)
+        results = cursor.fetchall()
+        if not results:
+            return "Query executed successfully\nResult: No tables found in database", True
+        return f"Query executed successfully\nTable Structure:\n{self.render_rows(cursor, results, len(results))}", True
+
+    def _handle_select(self, connection, cursor, query: str) -> Tuple[str, bool]:
+        """Render the rows returned by a SELECT."""
+        cursor.execute(query)
+        # Keep only the rows that will be shown; the rest are counted as they stream past
+        rows = cursor.fetchmany(self.DISPLAY_MAX_ROWS)
+        if not rows:
+            return "Query executed successfully\nResult: No rows returned", True
+        
+        row_count = len(rows) + sum(1 for _ in cursor)
+        col_count = len(cursor.description)
+        return f"Query executed successfully\nReturned: {row_count} row(s), {col_count} column(s)\n{self.render_rows(cursor, rows, row_count)}", True
+
+    def _handle_write(self, connection, cursor, query: str) -> Tuple[str, bool]:
+        """Run a statement that changes data or schema; the pool's autocommit commits it."""
+        cursor.execute(query)
+        return f"Query executed successfully\nAffected rows: {cursor.rowcount}", True
+
+    def render_rows(self, cursor, rows: List[Tuple], total: int) -> str:
+        """Render rows as right-aligned text columns under their column names."""
+        columns = [column[0] for column in cursor.description]
+        shown = columns[:self.DISPLAY_MAX_COLS]
+        cells = [[str(value) for value in row[:self.DISPLAY_MAX_COLS]] for row in rows]
+        widths = [max([len(name), *(len(row[i]) for row in cells)]) for i, name in enumerate(shown)]
+        
+        lines = ["  ".join(name.rjust(width) for name, width in zip(shown, widths))]
+        lines.extend("  ".join(cell.rjust(width) for cell, width in zip(row, widths)) for row in cells)
+        if total > len(rows):
+            lines.append(f"... {total} rows total")
+        if len(columns) > len(shown):
+            lines.append(f"... {len(columns)} columns total")
+        return "\n".join(lines)
 
     def execute_loop(self, loop_type: str, operation: str) -> Tuple[str, bool]:
         """Execute a generalized loop operation."""
@@ -352,44 +683,39 @@ class AIAgent:
             result = []  # Initialize result list at the start
             
             if loop_type == "FILE":
-                # Get all files in the current directory
-                files = [f for f in os.listdir(self.working_directory) if os.path.isfile(os.path.join(self.working_directory, f))]
+                # Get all files in the current directory; scandir entries know their type without
+                # a stat, and symlinks are skipped so a loop never reads outside the directory
+                with os.scandir(self.working_directory) as entries:
+                    files = [
+                        entry.name for entry in entries
+                        if entry.name != self.TEST_ENV_SENTINEL and entry.is_file(follow_symlinks=False)
+                    ]
                 
                 if not files:
                     return "No files found in current directory", False
                 
                 # Split the operation into command and arguments
-                cmd_parts = shlex.split(operation)
+                cmd_parts = split_command(operation)
                 command = cmd_parts[0]
                 command_args = cmd_parts[1:] if len(cmd_parts) > 1 else []
                 
-                # Validate command
-                if command not in self.command_rules:
-                    return f"Command '{command}' is not allowed", False
+                # Every file gets the same command and flags, so validate them once with
+                # a representative file; the result is memoised like any other command
+                is_valid, error_msg = self.validate_command(command, [*command_args, files[0]])
+                if not is_valid:
+                    return error_msg, False
+                
+                outputs = self.run_for_files(command, command_args, files) if command in self.LOOP_BATCH_COMMANDS else {}
+                
+                # Process the remaining files concurrently; each worker mostly waits on its child process
+                remaining = [file for file in files if file not in outputs]
+                if remaining:
+                    with ThreadPoolExecutor(max_workers=min(self.LOOP_WORKERS, len(remaining))) as executor:
+                        outputs.update(zip(remaining, executor.map(lambda file: self.run_for_file(command, command_args, file), remaining)))
                 
-                # Process each file
                 for file in files:
-                    file_path = os.path.join(self.working_directory, file)
                     result.append(f"\n=== {file} ===")
-                    
-                    try:
-                        # Execute command for this file
-                        cmd_result = subprocess.run(
-                            [command, *command_args, file_path],
-                            capture_output=True,
-                            text=True,
-                            timeout=30,
-                            cwd=self.working_directory,
-                            env={"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-                        )
-                        
-                        if cmd_result.returncode == 0:
-                            output = cmd_result.stdout.strip()
-                            result.append(output if output else "(no output)")
-                        else:
-                            result.append(f"Error: {cmd_result.stderr.strip()}")
-                    except Exception as e:
-                        result.append(f"Error processing {file}: {str(e)}")
+                    result.append(outputs[file])
                 
                 return "\n".join(result), True
                 
@@ -397,46 +723,50 @@ class AIAgent:
                 if not self.connect_to_db():
                     return "Failed to connect to database", False
                     
-                cursor = self.db_connection.cursor(dictionary=True)
-                cursor.execute("SHOW TABLES")
-                tables = [list(row.values())[0] for row in cursor.fetchall()]
+                with self.db_cursor() as (_, cursor):
+                    cursor.execute("SHOW TABLES")
+                    tables = [row[0] for row in cursor.fetchall()]
                 
-                if not tables:
-                    return "No tables found in database", False
+                    if not tables:
+                        return "No tables found in database", False
                     
-                # Parse LIMIT from operation if present
-                limit = None
-                if "LIMIT" in operation:
-                    parts = operation.split("LIMIT")
-                    operation = parts[0].strip()
-                    try:
-                        limit = int(parts[1].strip())
-                    except ValueError:
-                        return "Invalid LIMIT value", False
+                    # Parse LIMIT from operation if present
+                    limit = None
+                    if "LIMIT" in operation:
+                        parts = operation.split("LIMIT")
+                        operation = parts[0].strip()
+                        try:
+                            limit = int(parts[1].strip())
+                        except ValueError:
+                            return "Invalid LIMIT value", False
                         
-                for table in tables:
                     if operation == "SHOW":
-                        result.append(f"\n=== Table: {table} ===")
-                        query = f"SELECT * FROM {table}"
-                        if limit:
-                            query += f" LIMIT {limit}"
-                        cursor.execute(query)
-                        rows = cursor.fetchall()
-                        if not rows:
-                            result.append("(empty table)")
-                        else:
-                            df = pd.DataFrame(rows)
-                            result.append(df.to_string())
+                        query = "SELECT * FROM {}" + (f" LIMIT {limit}" if limit else "")
                     elif operation == "COUNT":
-                        cursor.execute(f"SELECT COUNT(*) as count FROM {table}")
-                        count = cursor.fetchone()['count']
-                        result.append(f"Table {table}: {count} rows")
+                        query = "SELECT COUNT(*) as count FROM {}"
                     elif operation == "DESCRIBE":
-                        cursor.execute(f"DESCRIBE {table}")
-                        structure = cursor.fetchall()
-                        df = pd.DataFrame(structure)
-                        result.append(f"\n=== Structure of {table} ===")
-                        result.append(df.to_string())
+                        query = "DESCRIBE {}"
+                    else:
+                        return f"Invalid table operation: {operation}", False
+                    
+                    # Send every table's statement in one round trip and walk the result sets in order
+                    cursor.execute(";".join(query.format(quote_identifier(table)) for table in tables))
+                    for table in tables:
+                        # Keep only the rows that will be shown and count the rest
+                        rows = cursor.fetchmany(self.DISPLAY_MAX_ROWS)
+                        total = len(rows) + sum(1 for _ in cursor)
+                        if operation == "SHOW":
+                            result.append(f"\n=== Table: {table} ===")
+                            if not rows:
+                                result.append("(empty table)")
+                            else:
+                                result.append(self.render_rows(cursor, rows, total))
+                        elif operation == "COUNT":
+                            result.append(f"Table {table}: {rows[0][0]} rows")
+                        elif operation == "DESCRIBE":
+                            result.append(f"\n=== Structure of {table} ===")
+                            result.append(self.render_rows(cursor, rows, total))
+                        cursor.nextset()
                         
                 return "\n".join(result), True
                 
@@ -445,309 +775,434 @@ class AIAgent:
         except Exception as e:
             return f"Error executing loop: {str(e)}", False
 
+    def run_for_files(self, command: str, command_args: List[str], files: List[str]) -> Dict[str, str]:
+        """Run a LOOP_BATCH_COMMANDS command once over many files and split its output per file."""
+        paths = {os.path.join(self.working_directory, file): file for file in files}
+        try:
+            cmd_result = self.run_process([command, *command_args, *paths], timeout=30)
+        except subprocess.TimeoutExpired:
+            return {}
+        
+        # Counts never contain '/', so each line's path starts at the working directory.
+        # Files the command failed on have no line and fall back to run_for_file.
+        outputs = {}
+        for line in cmd_result.stdout.splitlines():
+            start = line.find(self.working_directory_prefix)
+            file = paths.get(line[start:]) if start != -1 else None
+            if file is not None:
+                outputs[file] = line.strip()
+        return outputs
+
+    def run_for_file(self, command: str, command_args: List[str], file: str) -> str:
+        """Run one LOOP FILE command against a single file and describe the outcome."""
+        file_path = os.path.join(self.working_directory, file)
+        try:
+            # Execute command for this file
+            cmd_result = self.run_process([command, *command_args, file_path], timeout=30)
+            
+            if cmd_result.returncode == 0:
+                output = cmd_result.stdout.strip()
+                return output if output else "(no output)"
+            else:
+                return f"Error: {cmd_result.stderr.strip()}"
+        except Exception as e:
+            return f"Error processing {file}: {str(e)}"
+
+    def run_process(self, args: List[str], timeout: int = 300) -> subprocess.CompletedProcess:
+        """Run a command inside the working directory with a restricted environment."""
+        # Exec the pre-resolved binary directly; argv[0] keeps the short name.
+        # Keep preexec_fn, user, group and extra_groups unset: on Python 3.10+ any
+        # of them makes CPython fork instead of vfork. (3.9 always forks here,
+        # since posix_spawn is only used when cwd is None.)
+        rules = self.command_rules.get(args[0])
+        with subprocess.Popen(
+            args,
+            executable=rules.exe if rules else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=self.working_directory,
+            env=SUBPROCESS_ENV
+        ) as proc:
+            # Drain both pipes like communicate(), but stop the command once
+            # either passes OUTPUT_LIMIT instead of buffering all of it
+            output = {proc.stdout: bytearray(), proc.stderr: bytearray()}
+            deadline = time.monotonic() + timeout
+            truncated = False
+            with selectors.DefaultSelector() as selector:
+                selector.register(proc.stdout, selectors.EVENT_READ)
+                selector.register(proc.stderr, selectors.EVENT_READ)
+                while selector.get_map() and not truncated:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        proc.kill()
+                        raise subprocess.TimeoutExpired(args, timeout)
+                    for key, _ in selector.select(remaining):
+                        chunk = os.read(key.fd, 1 << 16)
+                        if not chunk:
+                            selector.unregister(key.fileobj)
+                        output[key.fileobj] += chunk
+                    truncated = any(len(buf) > self.OUTPUT_LIMIT for buf in output.values())
+            # Only a command we stopped gets its kill excused below
+            stopped = truncated and proc.poll() is None
+            if stopped:
+                proc.kill()
+            try:
+                returncode = proc.wait(timeout=max(deadline - time.monotonic(), 0))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                raise
+
+        stdout = output[proc.stdout][:self.OUTPUT_LIMIT].decode(errors='replace')
+        stderr = output[proc.stderr][:self.OUTPUT_LIMIT].decode(errors='replace')
+        if truncated:
+            # Show what was captured with a visible marker; the flag keeps the
+            # translation that produced it out of the translation cache
+            marker = f"[output truncated after {self.OUTPUT_LIMIT} bytes; command stopped]"
+            stdout += f"\n{marker}"
+            stderr += f"\n{marker}"
+            self.output_truncated = True
+            if stopped:
+                returncode = 0
+        return subprocess.CompletedProcess(args, returncode, stdout, stderr)
+
     def execute_command(self, command_str: str) -> Tuple[str, bool]:
         """Execute a command safely and return its output."""
         try:
             prompt = f"$ {command_str}"
             
             # Special handling for SQL queries
-            if command_str.strip().upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'SHOW', 'DESCRIBE', 'CREATE', 'USE')):
+            if SQL_KEYWORD_PATTERN.match(command_str):
                 result, success = self.execute_query(command_str)
                 return f"{prompt}\n{result}", success
 
-            args = shlex.split(command_str)
+            args = list(split_command(command_str))
             if not args:
                 return f"{prompt}\nEmpty command", False
             
             command = args[0]
             command_args = args[1:]
 
-            # Special handling for cd command
-            if command == 'cd':
-                if len(command_args) == 0:
-                    # cd without args goes to working_directory
-                    os.chdir(self.working_directory)
-                    return f"{prompt}\nChanged to {self.working_directory}", True
-                elif len(command_args) == 1:
-                    new_path = os.path.abspath(os.path.join(os.getcwd(), command_args[0]))
-                    if not new_path.startswith(self.working_directory):
-                        return f"{prompt}\nAccess denied: Cannot navigate outside of {self.working_directory}", False
-                    os.chdir(new_path)
-                    return f"{prompt}\nChanged to {new_path}", True
-                else:
-                    return f"{prompt}\nToo many arguments for cd command", False
+            # Commands with special handling get their own runner; the rest are validated and run as is
+            runner = self.command_runners.get(command, self._run_validated)
+            return runner(prompt, command_str, command, command_args)
+                
+        except subprocess.TimeoutExpired:
+            return f"{prompt}\nCommand timed out", False
+        except Exception as e:
+            return f"{prompt}\nError: {str(e)}", False
 
-            # Rest of the command handling...
-            # ... existing code ...
+    def _run_cd(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Change directory without leaving the working directory."""
+        if len(command_args) == 0:
+            # cd without args goes to working_directory
+            os.chdir(self.working_directory)
+            return f"{prompt}\nChanged to {self.working_directory}", True
+        elif len(command_args) == 1:
+            # chdir follows symlinks, so check where the link actually leads
+            new_path = os.path.realpath(command_args[0])
+            if not self.is_within_working_directory(new_path):
+                return f"{prompt}\nAccess denied: Cannot navigate outside of {self.working_directory}", False
+            os.chdir(new_path)
+            return f"{prompt}\nChanged to {new_path}", True
+        else:
+            return f"{prompt}\nToo many arguments for cd command", False
 
-            # Special handling for python -c commands
-            if command_str.strip().startswith(('python -c', 'python3 -c')):
-                args = shlex.split(command_str)
-                command = args[0]
-                command_args = args[1:]  # This will include -c and the code
-                
-                result = subprocess.run(
-                    [command, *command_args],
-                    capture_output=True,
-                    text=True,
-                    timeout=300,
-                    cwd=self.working_directory,
-                    env={"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-                )
-                
-                if result.returncode == 0:
-                    output = result.stdout.strip()
-                    return f"{prompt}\n{output if output else '(no output)'}", True
-                else:
-                    return f"{prompt}\n{result.stderr.strip()}", False
-            
-            # Special handling for pip/pip3 install
-            if command_str.strip().startswith(('pip install', 'pip3 install')):
-                args = shlex.split(command_str)
-                command = args[0]
-                command_args = args[1:]
-                
-                # First run pip install
-                result = subprocess.run(
-                    [command, *command_args],
-                    capture_output=True,
-                    text=True,
-                    timeout=300,
-                    cwd=self.working_directory,
-                    env={"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-                )
-                
-                if result.returncode == 0:
-                    # Verify installation by trying to import the package
-                    package_name = command_args[1] if len(command_args) > 1 else ""
-                    verify_cmd = f"python -c 'import {package_name}; print(f\"{package_name} version: \" + {package_name}.__version__)'"
-                    verify_result = subprocess.run(
-                        verify_cmd,
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        cwd=self.working_directory
-                    )
-                    
-                    if verify_result.returncode == 0:
-                        return f"{prompt}\nPackage installed and verified: {verify_result.stdout.strip()}", True
-                    else:
-                        return f"{prompt}\nPackage installed but verification failed: {verify_result.stderr.strip()}", False
-                else:
-                    return f"{prompt}\nPackage installation failed: {result.stderr.strip()}", False
-            
-            # Special handling for echo commands with redirection
-            if command_str.strip().startswith('echo') and ('>' in command_str or '>>' in command_str):
-                # Split the command into echo part and redirection part
-                parts = command_str.split('>', 1)
-                echo_cmd = parts[0].strip()
-                file_part = parts[1].strip().lstrip('>')  # Remove any extra '>' characters
-                
-                # Get the content and filename
-                content = echo_cmd[5:].strip().strip('"').strip("'")  # Remove echo and quotes
-                filename = file_part.strip()
-                
-                # Write to file
-                file_path = os.path.join(self.working_directory, filename)
-                with open(file_path, 'w') as f:
-                    f.write(content)
-                result, success = f'File "{filename}" overwritten with "{content}"', True
-                return f"{prompt}\n{result}", success
+    def _run_pip_status(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Virtual command reporting on a background package install."""
+        return self.install_status(prompt, command_args)
 
-            args = shlex.split(command_str)
-            if not args:
-                return f"{prompt}\nEmpty command", False
-                
-            command = args[0]
-            command_args = args[1:]
-            
-            # Special handling for pip/pip3 install
-            if command in {'pip', 'pip3'} and command_args and command_args[0] == 'install':
-                is_valid, error_msg = self.validate_pip_command(command_args)
-                if not is_valid:
-                    return error_msg, False
-                    
-                # Use python -m pip to ensure we're using the right Python environment
-                python_cmd = 'python' if command == 'pip' else 'python3'
-                result = subprocess.run(
-                    [python_cmd, '-m', 'pip'] + command_args,
-                    capture_output=True,
-                    text=True,
-                    timeout=300,
-                    cwd=self.working_directory,
-                    env={"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-                )
-                
-                if result.returncode == 0:
-                    return f"{prompt}\nSuccessfully installed package(s): {' '.join(command_args[1:])}", True
-                else:
-                    return f"{prompt}\nPackage installation failed: {result.stderr.strip()}", False
-            
-            # Special handling for python commands
-            elif command in {'python', 'python3'}:
-                # Ensure the file exists and is in the working directory
-                if len(command_args) > 0:
-                    script_path = os.path.join(self.working_directory, command_args[0])
-                    if not os.path.exists(script_path):
-                        return f"{prompt}\nFile not found: {command_args[0]}", False
-                    command_args[0] = script_path
-            
-            # Regular command validation
+    def _run_python(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Run python -c directly, or a script from the working directory."""
+        if command_args[:1] == ['-c']:
+            # command_args include -c and the code
+            return self.format_result(prompt, self.run_process([command, *command_args]))
+        
+        # Ensure the file exists and is in the working directory
+        if len(command_args) > 0:
+            script_path = os.path.join(self.working_directory, command_args[0])
+            if not os.path.exists(script_path):
+                return f"{prompt}\nFile not found: {command_args[0]}", False
+            command_args[0] = script_path
+        return self._run_validated(prompt, command_str, command, command_args)
+
+    def _run_pip(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Schedule pip installs of allowed packages; other pip commands run normally."""
+        if command_args[:1] != ['install']:
+            return self._run_validated(prompt, command_str, command, command_args)
+        
+        is_valid, error_msg = self.validate_pip_command(command_args)
+        if not is_valid:
+            return error_msg, False
+        return self.schedule_install(prompt, command_str, self.install_packages, command, command_args)
+
+    def _run_echo(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Handle echo with > or >> redirection into a working-directory file."""
+        if '>' not in command_str:
+            return self._run_validated(prompt, command_str, command, command_args)
+        
+        # Re-lex with '>' as punctuation so only unquoted redirections are found
+        lexer = shlex.shlex(command_str, posix=True, punctuation_chars='>')
+        lexer.whitespace_split = True
+        tokens = list(lexer)
+        redirect = next((i for i, token in enumerate(tokens) if token in ('>', '>>')), None)
+        if redirect is None:
+            return self._run_validated(prompt, command_str, command, command_args)
+        if redirect + 2 != len(tokens):
+            return f"{prompt}\nExpected a single file name after {tokens[redirect]}", False
+        
+        content = " ".join(tokens[1:redirect])
+        filename = tokens[redirect + 1]
+        if not self.validate_path(filename):
+            return f"Invalid path: {filename}", False
+        
+        # Write to file
+        file_path = os.path.join(self.working_directory, filename)
+        if tokens[redirect] == '>>':
+            with open(file_path, 'a') as f:
+                f.write(content + "\n")
+            return f'{prompt}\nFile "{filename}" appended with "{content}"', True
+        with open(file_path, 'w') as f:
+            f.write(content + "\n")
+        return f'{prompt}\nFile "{filename}" overwritten with "{content}"', True
+
+    def _run_validated(self, prompt: str, command_str: str, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Validate a command against its rules and run it."""
+        # Read-only commands with no arguments besides allowed flags skip validation
+        rules = self.command_rules.get(command)
+        fast_safe = command in self.FAST_SAFE_COMMANDS and all(
+            arg in rules.allowed_flags for arg in command_args
+        )
+        
+        # Regular command validation
+        if not fast_safe:
             is_valid, error_msg = self.validate_command(command, command_args)
             if not is_valid:
                 return error_msg, False
-            
-            # Execute command
-            result = subprocess.run(
-                [command, *command_args],
-                capture_output=True,
-                text=True,
-                timeout=300,
-                cwd=self.working_directory,
-                env={"PATH": "/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/sbin:/bin"}
-            )
-            
-            if result.returncode == 0:
-                output = result.stdout.strip()
-                return f"{prompt}\n{output if output else '(no output)'}", True
-            else:
-                return f"{prompt}\n{result.stderr.strip()}", False
-                
+        
+        # Execute command
+        return self.format_result(prompt, self.run_process([command, *command_args]))
+
+    def format_result(self, prompt: str, result: subprocess.CompletedProcess) -> Tuple[str, bool]:
+        """Echo the command followed by its output, or its errors if it failed."""
+        if result.returncode == 0:
+            output = result.stdout.strip()
+            return f"{prompt}\n{output if output else '(no output)'}", True
+        else:
+            return f"{prompt}\n{result.stderr.strip()}", False
+
+    def schedule_install(self, prompt: str, command_str: str, install, *args) -> Tuple[str, bool]:
+        """Queue a package install on the background worker and return its job id."""
+        if len(self.install_jobs) >= self.MAX_INSTALL_JOBS:
+            # Forget the oldest finished jobs nobody asked about
+            for old_id in [old_id for old_id, (_, future) in self.install_jobs.items() if future.done()]:
+                if len(self.install_jobs) < self.MAX_INSTALL_JOBS:
+                    break
+                del self.install_jobs[old_id]
+            if len(self.install_jobs) >= self.MAX_INSTALL_JOBS:
+                return f"{prompt}\nToo many installs queued; check them with pip_status first", False
+        job_id = next(self.install_job_ids)
+        self.install_jobs[job_id] = (command_str, self.install_executor.submit(install, *args))
+        return f"{prompt}\nInstall scheduled: job {job_id}\nCheck progress with: pip_status {job_id}", True
+
+    def install_status(self, prompt: str, args: List[str]) -> Tuple[str, bool]:
+        """Report on a background install started by schedule_install."""
+        if len(args) != 1 or not args[0].isdigit():
+            return f"{prompt}\nUsage: pip_status <job id>", False
+        job = self.install_jobs.get(int(args[0]))
+        if job is None:
+            return f"{prompt}\nNo install job {args[0]}", False
+        
+        command_str, future = job
+        if not future.done():
+            return f"{prompt}\nJob {args[0]} ({command_str}): still running", True
+        # A finished job is reported once, then forgotten
+        self.install_jobs.pop(int(args[0]), None)
+        try:
+            result, success = future.result()
         except subprocess.TimeoutExpired:
-            return f"{prompt}\nCommand timed out", False
+            result, success = "Command timed out", False
         except Exception as e:
-            return f"{prompt}\nError: {str(e)}", False
+            result, success = f"Error: {str(e)}", False
+        return f"{prompt}\nJob {args[0]} ({command_str}): {result}", success
+
+    def install_packages(self, command: str, command_args: List[str]) -> Tuple[str, bool]:
+        """Run pip install and report what it installed."""
+        result = self.run_process([command, *command_args])
+        if result.returncode != 0:
+            return f"Package installation failed: {result.stderr.strip()}", False
+        
+        # pip names the installed versions on its own output, so there is no
+        # need to start another interpreter just to import the package
+        installed = next(
+            (line for line in reversed(result.stdout.splitlines()) if line.startswith("Successfully installed")),
+            None
+        )
+        return installed or "Requirement already satisfied", True
 
     def get_response(self, user_input: str) -> str:
         """Get a response from the AI agent using a two-step process."""
         self.add_to_history("user", user_input)
         
-        # Step 1: Safety Check
-        safety_prompt = """You are a security validator for shell commands. Your job is to determine if a natural language command could be harmful.
-        
-        Safe commands include:
-        - File reading/listing (ls, cat, head, tail, less, pwd)
-        - File searching/counting (find, grep, wc)
-        - System information (pwd, ps, df, du)
-        - Basic text processing (sort, uniq, echo)
-        - Development tools (python, pip with allowed packages)
-        
-        Consider a command UNSAFE only if it could:
-        1. Modify or delete files/directories (rm, mv, chmod, chown)
-        2. Access sensitive system files (/etc/passwd, /etc/shadow)
-        3. Change system settings or configuration
-        4. Execute arbitrary downloaded code
-        5. Access network services or open ports
-        6. Attempt privilege escalation
-        
-        Output ONLY 'SAFE' or 'UNSAFE: <specific reason>'.
-        When in doubt about a command's safety, consider it SAFE and let the command validator handle specific restrictions.
-        """
+        # Repeated requests in the same context reuse the earlier translation and
+        # skip both model calls. Only translations of input classified SAFE are
+        # stored, and the exact input is part of the key, so a hit carries that verdict.
+        cache_key = self.translation_cache_key(user_input)
+        cached_translation = self.translation_cache.get(cache_key)
+        if cached_translation is None and self.translation_store is not None:
+            cached_translation = self.translation_store.get(cache_key)
+        if cached_translation is not None:
+            self.remember_translation(cache_key, cached_translation)
+            self.add_to_history("assistant", cached_translation)
+            try:
+                response, success = self.run_translation(cached_translation)
+            except Exception as e:
+                success = False
+                response = f"Error processing command: {str(e)}"
+            if not success:
+                # Rules or environment changed; ask the model again next time
+                self.forget_translation(cache_key)
+            return response
         
         try:
-            safety_check = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": safety_prompt},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=0.1,
-                max_tokens=50
-            )
-            
-            safety_result = safety_check.choices[0].message.content.strip()
+            # Both model calls are independent, so run them side by side; the
+            # translation is only used, or even kept in history, once the input is SAFE
+            safety_check = self.safety_executor.submit(self.check_safety, user_input)
+            translation_result = self.stream_translation(self.translation_messages)
+            safety_result = safety_check.result()
             
             if not safety_result.startswith('SAFE'):
                 return f"Command rejected: {safety_result.replace('UNSAFE: ', '')}"
             
-            # Step 2: Command Translation
-            translation_prompt = """You are an expert Linux command translator. Convert natural language into executable shell commands.
-            
-            Current working directory: /app/test
-            Available commands: ls, cd, grep, find, cat, head, tail, wc, sort, uniq, echo, ps, df, du, pwd, python, pip
-            
-            Rules:
-            1. For database operations, use format: EXECUTE: <sql_query>
-            2. For operations on files, choose between:
-               a) Single command (if possible): EXECUTE: <command>
-               b) Loop over files: LOOP: FILE:<command>
-            3. For database connections, use format: CONNECT: {connection_json}
-            
-            Examples:
-            - "show size of each file" → LOOP: FILE:du -h
-            - "show content of all files" → LOOP: FILE:cat
-            - "count lines in each file" → LOOP: FILE:wc -l
-            - "list files" → EXECUTE: ls
-            - "show current directory" → EXECUTE: pwd
-            - "find all python files" → EXECUTE: find . -name "*.py"
-            - "show first 5 lines of each file" → LOOP: FILE:head -n 5
-            
-            Plan your translation:
-            1. Identify if the operation needs to be applied to each file or can be done with a single command
-            2. Choose the most appropriate command
-            3. Add necessary flags and arguments
-            4. Validate paths are within working directory
-            
-            Output format:
-            PLAN: Brief explanation of what you'll do
-            COMMAND: The actual command to execute
-            """
-            
-            translation = self.client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": translation_prompt},
-                    *self.conversation_history[-4:],
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=0.7,
-                max_tokens=150
-            )
-            
-            translation_result = translation.choices[0].message.content.strip()
             self.add_to_history("assistant", translation_result)
             
-            # Extract command from translation
-            if "COMMAND:" in translation_result:
-                command = translation_result.split("COMMAND:")[1].strip()
-                
-                # Handle different command types
-                if command.startswith("EXECUTE:"):
-                    cmd = command.split("EXECUTE:")[1].strip()
-                    result, success = self.execute_command(cmd)
-                    return f"{translation_result}\n\nResult:\n{result}"
-                elif command.startswith("LOOP:"):
-                    loop_cmd = command.split("LOOP:")[1].strip()
-                    loop_type, operation = loop_cmd.split(":")
-                    result, success = self.execute_loop(loop_type.strip(), operation.strip())
-                    return f"{translation_result}\n\nResult:\n{result}"
-                elif command.startswith("CONNECT:"):
-                    conn_details = json.loads(command.split("CONNECT:")[1].strip())
-                    result = self.connect_to_new_database(conn_details)
-                    return f"{translation_result}\n\nResult:\n{result}"
-                else:
-                    result, success = self.execute_command(command)
-                    return f"{translation_result}\n\nResult:\n{result}"
-            
-            return "Error: Could not extract command from translation"
+            self.output_truncated = False
+            response, success = self.run_translation(translation_result)
+            if success and not self.output_truncated:
+                # Only remember translations whose command validated and ran
+                self.remember_translation(cache_key, translation_result)
+            return response
             
         except Exception as e:
             error_msg = f"Error processing command: {str(e)}"
             print(error_msg)  # Print for debugging
             return error_msg
 
+    def translation_cache_key(self, user_input: str) -> str:
+        """Key a translation by API key, model and prompt, the exact request and the turn it follows."""
+        context = self.translation_messages[1:-1][-self.TRANSLATION_CACHE_CONTEXT:]
+        payload = json.dumps([self.cache_scope, self.TRANSLATION_CACHE_VERSION, context, user_input.strip()])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def check_safety(self, user_input: str) -> str:
+        """Classify a request as SAFE or UNSAFE: <reason>."""
+        safety_check = self.client.chat.completions.create(
+            messages=[
+                self.SAFETY_MESSAGE,
+                {"role": "user", "content": user_input}
+            ],
+            **self.SAFETY_REQUEST
+        )
+        return safety_check.choices[0].message.content.strip()
+
+    def remember_translation(self, cache_key: str, translation_result: str):
+        """Store a translation in the in-memory LRU and the on-disk store."""
+        self.translation_cache[cache_key] = translation_result
+        self.translation_cache.move_to_end(cache_key)
+        if len(self.translation_cache) > self.TRANSLATION_CACHE_SIZE:
+            self.translation_cache.popitem(last=False)
+        
+        # Connection details carry credentials, so they never go to disk
+        if self.translation_store is not None and "CONNECT:" not in translation_result:
+            self.translation_store.set(cache_key, translation_result)
+
+    def forget_translation(self, cache_key: str):
+        """Drop a translation from both caches."""
+        self.translation_cache.pop(cache_key, None)
+        if self.translation_store is not None:
+            self.translation_store.discard(cache_key)
+
+    def run_translation(self, translation_result: str) -> Tuple[str, bool]:
+        """Execute the command extracted from a translation."""
+        # Extract the directive and its payload from translation in one scan
+        match = COMMAND_PATTERN.search(translation_result)
+        if match is None:
+            return "Error: Could not extract command from translation", False
+        
+        directive, command = match.group(1), match.group(2).strip()
+        
+        # Handle different command types
+        if directive == "EXECUTE":
+            result, success = self.execute_command(command)
+        elif directive == "LOOP":
+            loop_type, _, operation = command.partition(":")
+            result, success = self.execute_loop(loop_type.strip(), operation.strip())
+        elif directive == "CONNECT":
+            conn_details = json.loads(command)
+            result = self.connect_to_new_database(conn_details)
+            success = result.startswith("Connection Status: Success")
+        else:
+            result, success = self.execute_command(command)
+        return f"{translation_result}\n\nResult:\n{result}", success
+
+    def stream_translation(self, messages: List[Dict]) -> str:
+        """Stream the translation and stop as soon as the COMMAND line is complete."""
+        stream = self.client.chat.completions.create(messages=messages, **self.TRANSLATION_REQUEST)
+        
+        chunks = []
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                chunks.append(delta)
+                
+                # Only re-check the buffer when a line has just been finished
+                if '\n' not in delta:
+                    continue
+                text = "".join(chunks)
+                marker = text.find("COMMAND:")
+                if marker == -1:
+                    continue
+                line_end = text.find('\n', marker)
+                if line_end != -1 and text[marker + len("COMMAND:"):line_end].strip():
+                    # The directive is complete; skip the rest of the generation
+                    return text[:line_end].strip()
+        finally:
+            stream.close()
+        
+        return "".join(chunks).strip()
+
+    def show_progress(self, message: str):
+        """Print a connection progress line for someone watching a terminal."""
+        # Served or piped output would only fill the logs with one write per step
+        if sys.stdout.isatty():
+            print(f"\r{message}")
+
     def show_loading_animation(self, stop_event: threading.Event, message: str = "Connecting to database"):
         """Show a loading animation while waiting."""
         spinner = itertools.cycle(['��', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏'])
         while not stop_event.is_set():
             sys.stdout.write(f'\r{message} {next(spinner)}')
             sys.stdout.flush()
-            time.sleep(0.1)
+            stop_event.wait(0.1)  # Wakes as soon as the work is done
         sys.stdout.write('\r' + ' ' * (len(message) + 2) + '\r')  # Clear the line
         sys.stdout.flush()
 
     def ensure_docker_network(self) -> Tuple[bool, str]:
         """Ensure the Docker network exists and containers are connected."""
+        if not IN_DOCKER:
+            return True, "Not running in Docker; skipping network setup"
+        
+        # Containers keep their network membership for the life of the process
+        if AIAgent.docker_network_message is not None:
+            return True, AIAgent.docker_network_message
+        
+        # Imported here so only database connections pay for the docker SDK
+        import docker
+        from docker.errors import NotFound, APIError
+        
         try:
             # Initialize Docker client
             docker_client = docker.from_env()
@@ -756,7 +1211,7 @@ class AIAgent:
             # Check if network exists
             try:
                 network = docker_client.networks.get(network_name)
-                print(f"\rFound existing network: {network_name}")
+                self.show_progress(f"Found existing network: {network_name}")
             except NotFound:
                 # Create network if it doesn't exist
                 network = docker_client.networks.create(
@@ -764,34 +1219,25 @@ class AIAgent:
                     driver="bridge",
                     check_duplicate=True
                 )
-                print(f"\rCreated new network: {network_name}")
-            
-            # Get current container ID
-            with open('/proc/self/cgroup', 'r') as f:
-                for line in f:
-                    if 'docker' in line:
-                        current_container_id = line.split('/')[-1].strip()
-                        break
+                self.show_progress(f"Created new network: {network_name}")
             
-            # Connect current container to network if not already connected
-            try:
-                current_container = docker_client.containers.get(current_container_id)
-                network.connect(current_container)
-                print(f"\rConnected current container to network")
-            except APIError as e:
-                if 'already exists' not in str(e):
-                    raise
+            # Containers the network inspection already lists need no connect call
+            attached = network.attrs.get('Containers') or {}
+            attached_names = {info.get('Name') for info in attached.values()}
             
-            # Connect MySQL container to network if not already connected
-            try:
-                mysql_container = docker_client.containers.get('mysql_container')
-                network.connect(mysql_container)
-                print(f"\rConnected MySQL container to network")
-            except APIError as e:
-                if 'already exists' not in str(e):
-                    raise
+            # Connect this container and the MySQL container by id/name; no need to fetch them first
+            for container, label in ((current_container_id(), "current container"), ('mysql_container', "MySQL container")):
+                if container in attached or container in attached_names:
+                    continue
+                try:
+                    network.connect(container)
+                    self.show_progress(f"Connected {label} to network")
+                except APIError as e:
+                    if 'already exists' not in str(e):
+                        raise
             
-            return True, f"Network {network_name} is ready"
+            AIAgent.docker_network_message = f"Network {network_name} is ready"
+            return True, AIAgent.docker_network_message
             
         except Exception as e:
             return False, f"Failed to setup Docker network: {str(e)}"
@@ -810,61 +1256,82 @@ class AIAgent:
             args=(stop_loading, f"Connecting to {db_type.upper()} at {connection_details.get('host', 'unknown host')}")
         )
         loading_thread.daemon = True
+        # The spinner is only for people watching a terminal, not piped or served output
+        show_spinner = sys.stdout.isatty()
         
         try:
-            print(f"\rStarting {db_type} connection process...")
-            loading_thread.start()
+            self.show_progress(f"Starting {db_type} connection process...")
+            if show_spinner:
+                loading_thread.start()
             
-            # Close existing connection if any
-            if self.db_connection and self.db_connection.is_connected():
-                print("\rClosing existing connection...")
-                self.db_connection.close()
+            # A repeated CONNECT to the same server reuses the warm pool, unless a
+            # USE has moved its sessions away from the configured database
+            pool = None
+            if self.db_pool and self.current_database is None and connection_details == self.db_config:
+                self.show_progress("Reusing existing connection pool...")
+                pool = self.db_pool
+            elif self.db_pool:
+                self.show_progress("Closing existing connection...")
+                self.close_db_pool()
             
             # Validate required connection parameters
-            required_params = {'type', 'host', 'user', 'password'}
-            missing_params = required_params - set(connection_details.keys())
+            missing_params = [param for param in self.REQUIRED_CONNECTION_PARAMS if param not in connection_details]
             if missing_params:
                 return f"Connection Failed\nMissing required parameters: {', '.join(missing_params)}\nReceived: {connection_details}"
             
-            print(f"\rAttempting {db_type} connection to {connection_details['host']}...")
+            self.show_progress(f"Attempting {db_type} connection to {connection_details['host']}...")
+            
+            # Driver arguments are built once for whichever branch runs
+            connect_args = {k: v for k, v in connection_details.items() if k != 'type'}
+            connect_args.setdefault('connect_timeout', 10)
             
-            # Create new connection based on database type
+            # Create new connection based on database type; only driver errors
+            # are reported as connection failures, anything else is a bug
+            driver_errors = (Error,)
             try:
-                if db_type == 'mysql':
-                    self.db_connection = mysql.connector.connect(
-                        **{k: v for k, v in connection_details.items() if k != 'type'},
-                        connect_timeout=10
+                if pool is not None:
+                    connection = pool.get_connection()
+                elif db_type == 'mysql':
+                    # Sessions are not reset on return, so run in autocommit: no
+                    # borrower is left inside a transaction (stale REPEATABLE READ
+                    # snapshot, held metadata locks) that the next one inherits
+                    pool = OptimisticConnectionPool(
+                        pool_name="easylinux",
+                        pool_size=self.DB_POOL_SIZE,
+                        pool_reset_session=False,
+                        **dict(connect_args, autocommit=True)
                     )
+                    connection = pool.get_connection()
                 elif db_type == 'postgresql':
                     import psycopg2
-                    self.db_connection = psycopg2.connect(
-                        **{k: v for k, v in connection_details.items() if k != 'type'},
-                        connect_timeout=10
-                    )
+                    driver_errors = (Error, psycopg2.Error)
+                    connection = psycopg2.connect(**connect_args)
                 else:
                     return f"Unsupported database type: {db_type}"
                     
-            except (Error, Exception) as e:
+            except driver_errors as e:
+                if pool is not None and pool is not self.db_pool:
+                    pool._remove_connections()
                 return f"Connection Error\n{db_type.upper()} Error: {str(e)}\nHost: {connection_details['host']}\nUser: {connection_details['user']}"
             
             self.db_config = connection_details  # Update stored config
+            self.current_database = None
             
             # Test connection based on database type
-            if hasattr(self.db_connection, 'is_connected') and self.db_connection.is_connected():
-                cursor = self.db_connection.cursor()
+            if hasattr(connection, 'is_connected') and connection.is_connected():
+                cursor = connection.cursor()
                 try:
-                    print("\rTesting connection...")
+                    self.show_progress("Testing connection...")
                     cursor.execute("SELECT 1")
                     cursor.fetchone()
-                    print("\rConnection test passed...")
+                    self.show_progress("Connection test passed...")
                     
-                    # Get database info based on type
-                    if db_type == 'mysql':
-                        cursor.execute("SELECT DATABASE(), VERSION(), USER(), CURRENT_USER()")
-                    elif db_type == 'postgresql':
-                        cursor.execute("SELECT current_database(), version(), current_user, session_user")
-                        
-                    db_name, version, user, current_user = cursor.fetchone()
+                    # The handshake already reported the server version, and the database
+                    # and user are the ones we connected with, so skip the info query
+                    version = connection.get_server_info()
+                    db_name = connection_details.get('database')
+                    user = connection_details['user']
+                    self.db_pool = pool
                     
                     return (
                         f"Connection Status: Success\n"
@@ -876,35 +1343,55 @@ class AIAgent:
                         f"Connection Test: Passed\n"
                         f"Ready for queries"
                     )
-                except (Error, Exception) as e:
+                except Error as e:
                     return f"Connection Warning\nConnected but test query failed\nError: {str(e)}"
                 finally:
                     cursor.close()
+                    connection.close()
+                    # A pool built for this attempt is only kept if its test passed
+                    if pool is not None and pool is not self.db_pool:
+                        pool._remove_connections()
             else:
+                connection.close()
+                if pool is not None and pool is not self.db_pool:
+                    pool._remove_connections()
                 return f"Connection Status: Failed\nCould not establish connection to {connection_details['host']}"
             
         except Exception as e:
             return f"Unexpected Error\nType: {type(e).__name__}\nDetails: {str(e)}"
         finally:
-            print("\rCleaning up connection attempt...")
+            self.show_progress("Cleaning up connection attempt...")
             stop_loading.set()
-            loading_thread.join()
+            if show_spinner:
+                loading_thread.join()
+
+    def close(self):
+        """Release the database pool, worker threads and HTTP connections held by this agent."""
+        self.close_db_pool()
+        self.install_executor.shutdown(wait=False)
+        self.safety_executor.shutdown(wait=False)
+        self.client.close()
+
+    def close_db_pool(self):
+        """Close the idle connections held by the pool and drop it."""
+        pool, self.db_pool = self.db_pool, None
+        self.current_database = None
+        self.session_databases.clear()
+        if pool:
+            pool._remove_connections()
 
     def disconnect_database(self) -> str:
         """Disconnect from the current database."""
         try:
-            if self.db_connection:
-                if self.db_connection.is_connected():
-                    db_info = f"host={self.db_config.get('host', 'unknown')}"
-                    if 'database' in self.db_config:
-                        db_info += f", database={self.db_config['database']}"
-                    self.db_connection.close()
-                    self.db_connection = None
-                    return f"Disconnect Status: Success\nDisconnected from: {db_info}\nConnection state: Closed"
-                return "Disconnect Status: No action needed\nReason: Connection already closed"
+            if self.db_pool:
+                db_info = f"host={self.db_config.get('host', 'unknown')}"
+                if 'database' in self.db_config:
+                    db_info += f", database={self.db_config['database']}"
+                self.close_db_pool()
+                return f"Disconnect Status: Success\nDisconnected from: {db_info}\nConnection state: Closed"
             return "Disconnect Status: No action needed\nReason: No active connection"
         except Error as e:
-            self.db_connection = None  # Reset connection on error
+            self.db_pool = None  # Reset connection on error
             return f"Disconnect Warning\nError while disconnecting: {str(e)}\nConnection state: Reset"
 
     def get_current_database(self) -> str:
@@ -913,10 +1400,9 @@ class AIAgent:
             if not self.connect_to_db():
                 return "Not connected to any database"
 
-            cursor = self.db_connection.cursor()
-            cursor.execute("SELECT DATABASE()")
-            db_name = cursor.fetchone()[0]
-            cursor.close()
+            with self.db_cursor() as (_, cursor):
+                cursor.execute("SELECT DATABASE()")
+                db_name = cursor.fetchone()[0]
             return db_name if db_name else "No database selected"
         except Error as e:
             return f"Error getting database name: {str(e)}"
\ No newline at end of file
@@ -1,4 +0,0 @@
-from flask_cors import CORS
-
-app = Flask(__name__)
-CORS(app, supports_credentials=True, origins=["http://localhost:5000"]) 
\ No newline at end of file
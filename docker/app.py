@@ -2,18 +2,54 @@ from flask import Flask, request, jsonify
 from flask_cors import CORS
 from agent import AIAgent
 from dotenv import load_dotenv
+import hashlib
 import os
-from openai import OpenAI
+import threading
+import time
+from collections import OrderedDict
+from openai import AuthenticationError, OpenAI
 import logging
 
 app = Flask(__name__)
-CORS(app, supports_credentials=True, origins=["http://localhost:8080"])
+# Browsers may reuse a preflight answer for a day instead of repeating it before each request
+CORS(app, supports_credentials=True, origins=["http://localhost:8080"], max_age=86400)
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-agents = {}
+# One agent per API key, holding its history and database pool; the least
+# recently used agent is dropped once MAX_AGENTS are alive
+agents = OrderedDict()
+agents_lock = threading.Lock()
+MAX_AGENTS = 256
+
+# Recent /validate outcomes keyed by a digest of the API key:
+# digest -> (error or None if valid, expiry time)
+validation_results = OrderedDict()
+validation_lock = threading.Lock()
+VALIDATION_TTL = 600  # seconds
+REJECTION_TTL = 60  # seconds; rejected keys are rechecked sooner
+MAX_VALIDATION_RESULTS = 4096
+
+def remember_validation(digest, error, ttl):
+    """Record a /validate outcome, keeping at most MAX_VALIDATION_RESULTS entries."""
+    now = time.monotonic()
+    with validation_lock:
+        # Re-inserting keeps the table ordered oldest first
+        validation_results.pop(digest, None)
+        if len(validation_results) >= MAX_VALIDATION_RESULTS:
+            for key, (_, expires) in list(validation_results.items()):
+                if expires <= now:
+                    del validation_results[key]
+        while len(validation_results) >= MAX_VALIDATION_RESULTS:
+            validation_results.popitem(last=False)
+        validation_results[digest] = (error, now + ttl)
+
+def recall_validation(digest):
+    """Return (error, expiry time) for a key checked recently."""
+    with validation_lock:
+        return validation_results.get(digest, (None, 0))
 
 @app.route('/validate', methods=['POST'])
 def validate_api_key():
@@ -23,26 +59,64 @@ def validate_api_key():
     if not api_key:
         return jsonify({'valid': False, 'error': 'No API key provided'}), 400
     
+    # A key checked recently skips the round trip to OpenAI
+    digest = hashlib.sha256(api_key.encode()).hexdigest()
+    error, expires = recall_validation(digest)
+    if expires > time.monotonic():
+        if error is None:
+            return jsonify({'valid': True})
+        return jsonify({'valid': False, 'error': error}), 401
+    
     try:
         # Try to create a client and make a simple API call to validate the key
         client = OpenAI(api_key=api_key)
         # Just list models to verify the key works
         models = client.models.list()
+        remember_validation(digest, None, VALIDATION_TTL)
         return jsonify({'valid': True})
+    except AuthenticationError as e:
+        # Only an outright rejection is cached; other failures may be transient
+        logger.error(f"API key validation error: {str(e)}")
+        remember_validation(digest, str(e), REJECTION_TTL)
+        return jsonify({'valid': False, 'error': str(e)}), 401
     except Exception as e:
         logger.error(f"API key validation error: {str(e)}")
         return jsonify({'valid': False, 'error': str(e)}), 401
 
+def get_agent(api_key):
+    """Get or create the agent for an API key and mark it most recently used."""
+    with agents_lock:
+        agent = agents.get(api_key)
+        if agent is not None:
+            agents.move_to_end(api_key)
+            return agent
+    
+    # Building an agent touches the filesystem, so it happens outside the lock;
+    # if another request won the race, its agent is kept and this one discarded
+    new_agent = AIAgent(api_key)
+    evicted = []
+    with agents_lock:
+        agent = agents.setdefault(api_key, new_agent)
+        agents.move_to_end(api_key)
+        while len(agents) > MAX_AGENTS:
+            evicted.append(agents.popitem(last=False)[1])
+    if agent is not new_agent:
+        evicted.append(new_agent)
+    
+    # Release pools, threads and HTTP connections without holding up other requests
+    for old_agent in evicted:
+        try:
+            old_agent.close()
+        except Exception as e:
+            logger.error(f"Agent cleanup error: {str(e)}")
+    return agent
+
 @app.route('/chat', methods=['POST'])
 def chat():
     api_key = request.headers.get('X-API-Key')
     if not api_key:
         return jsonify({'error': 'No API key provided'}), 401
     
-    # Get or create agent for this API key
-    if api_key not in agents:
-        agents[api_key] = AIAgent(api_key)
-    
     data = request.json
     user_input = data.get('message', '')
     
@@ -50,7 +124,7 @@ def chat():
         return jsonify({'error': 'No message provided'}), 400
     
     try:
-        response = agents[api_key].get_response(user_input)
+        response = get_agent(api_key).get_response(user_input)
         return jsonify({'response': response})
     except Exception as e:
         logger.error(f"Chat error: {str(e)}")
@@ -1,7 +1,26 @@
 from agent import AIAgent
 from dotenv import load_dotenv
+import atexit
 import os
 
+try:
+    import readline  # Line editing and recall for input(); missing on Windows
+except ImportError:
+    readline = None
+
+HISTORY_FILE = os.path.expanduser("~/.easylinux_history")
+
+def setup_history():
+    """Load earlier inputs for arrow-key recall and save them on exit."""
+    if readline is None:
+        return
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except OSError:
+        pass  # First run, or the file is unreadable
+    readline.set_history_length(1000)
+    atexit.register(readline.write_history_file, HISTORY_FILE)
+
 def main():
     # Load environment variables from .env file
     load_dotenv()
@@ -15,11 +34,16 @@ def main():
     
     # Initialize the agent
     agent = AIAgent(api_key)
+    setup_history()
     
     print("AI Agent initialized. Type 'quit' to exit.")
     
     while True:
-        user_input = input("You: ")
+        try:
+            user_input = input("You: ")
+        except (EOFError, KeyboardInterrupt):
+            print()
+            break
         
         if user_input.lower() == 'quit':
             break
@@ -28,4 +52,4 @@ def main():
         print(f"Agent: {response}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()